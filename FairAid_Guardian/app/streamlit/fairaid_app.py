@@ -1,13 +1,110 @@
 import streamlit as st
 import pandas as pd
-from snowflake.snowpark.context import get_active_session
+import numpy as np
+import pyarrow.compute as pc
+from snowflake.snowpark.functions import col
 import altair as alt
 
 # Set page layout
 st.set_page_config(layout="wide", page_title="FairAid Guardian")
 
 # Setup Session
-session = get_active_session()
+# Cached as a resource: the live handle is shared across reruns and never serialized.
+# Deployments outside Snowflake can build their own Session here and pay the connect cost once.
+@st.cache_resource
+def get_session():
+    from snowflake.snowpark.context import get_active_session
+    return get_active_session()
+
+session = get_session()
+
+# Arrow Materialization
+# Hand Arrow buffers straight to pandas instead of consolidating them into NumPy blocks,
+# which would briefly hold two copies of every result set.
+def single_query(snow_df):
+    # The cursor paths below run one statement; refuse plans that need setup queries first
+    queries = snow_df.queries["queries"]
+    if len(queries) != 1:
+        raise ValueError(f"Expected a single-statement Snowpark plan, got {len(queries)} queries")
+    return queries[0]
+
+def to_arrow_pandas(snow_df):
+    if hasattr(snow_df, "to_arrow"):
+        table = snow_df.to_arrow()
+    else:
+        # Older Snowpark releases: run the query on the connector cursor and fetch Arrow directly.
+        # force_return_table keeps the schema for empty results, so dtypes don't depend on row count.
+        with session.connection.cursor() as cursor:
+            table = cursor.execute(single_query(snow_df)).fetch_arrow_all(force_return_table=True)
+    return table.to_pandas(split_blocks=True, self_destruct=True, types_mapper=pd.ArrowDtype)
+
+# Cached Queries
+# Every widget interaction reruns this script, so query results are kept in memory
+# for a while instead of making a Snowflake round-trip on each rerun.
+@st.cache_data(ttl=600)
+def load_kpis():
+    # Aggregate in Snowflake so only three scalars come back. Keep the SQL deterministic
+    # (no CURRENT_TIMESTAMP etc.) so the result cache can answer repeated runs.
+    # Headline KPIs are global and ignore the region filter; COALESCE keeps an empty view at 0.
+    row = session.sql("""
+        SELECT COALESCE(SUM(total_distributed), 0) AS total_aid,
+               COALESCE(SUM(total_beneficiaries), 0) AS total_ben,
+               COALESCE(AVG(avg_amount), 0) AS avg_aid -- Average of regional averages, roughly
+        FROM core.vw_coverage_stats
+    """).collect()[0]
+    return row['TOTAL_AID'], row['TOTAL_BEN'], row['AVG_AID']
+
+def filter_region(snow_df, region):
+    # Push the region filter down to Snowflake so other regions' rows are never shipped
+    if region and region != "All":
+        return snow_df.filter(col("REGION") == region)
+    return snow_df
+
+@st.cache_data(ttl=600)
+def load_fairness(region):
+    return to_arrow_pandas(filter_region(session.table("core.vw_fairness_analysis"), region))
+
+@st.cache_data(ttl=60) # Same fast TTL as the risk cards, so both anomaly surfaces refresh together
+def load_anomaly_count():
+    # Global count for the headline KPI, independent of the region filter
+    return session.sql("SELECT COUNT(*) FROM core.vw_anomalies").collect()[0][0]
+
+@st.cache_data(ttl=60) # Anomalies change fastest, keep them fresher
+def load_anomaly_cards(region):
+    # Only three string columns are displayed, so format the risk cards straight from the
+    # connector's Arrow batches without ever building a pandas frame.
+    anomalies = session.table("core.vw_anomalies")
+    if region and region != "All":
+        # The view is keyed by beneficiary only (so cross-region double enrollment is still caught);
+        # narrow it with a semi-join on the beneficiaries enrolled in the selected region
+        region_ids = filter_region(session.table("core.demo_beneficiaries"), region).select("BENEFICIARY_ID")
+        anomalies = anomalies.filter(col("BENEFICIARY_ID").isin(region_ids))
+    query = anomalies.select("RISK_SCORE", "BENEFICIARY_ID", "ANOMALY_TYPE")
+    cards = []
+    with session.connection.cursor() as cursor:
+        cursor.execute(single_query(query))
+        for batch in cursor.fetch_arrow_batches():
+            # Pick the card style for the whole batch in one vectorized compare-and-select
+            css_classes = pc.if_else(pc.equal(batch.column(0), "High"), "risk-high", "risk-med").to_pylist()
+            risks = batch.column(0).to_pylist()
+            ben_ids = batch.column(1).to_pylist()
+            issues = batch.column(2).to_pylist()
+            cards.extend(
+                f'<div class="{css_class}">'
+                f'<b>{risk} RISK</b><br>Beneficiary ID: {ben_id}<br>Issue: {issue}</div><br>'
+                for css_class, risk, ben_id, issue in zip(css_classes, risks, ben_ids, issues)
+            )
+    return "".join(cards)
+
+@st.cache_data(ttl=600)
+def load_regions(data_source):
+    # Only a short list is needed, so read it off the collected rows without a DataFrame
+    return [row[0] for row in session.sql(f"SELECT DISTINCT region FROM {data_source} ORDER BY region").collect()]
+
+@st.cache_data(ttl=600)
+def load_raw_preview(data_source):
+    # A fixed LIMIT (rather than SAMPLE) keeps the statement repeatable for the result cache
+    return to_arrow_pandas(session.sql(f"SELECT * FROM {data_source} LIMIT 100"))
 
 # Styling
 st.markdown("""
@@ -19,6 +116,24 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+def color_status(status):
+    # Styler rule for the STATUS column only, evaluated for the whole column at once
+    return np.where(status.astype(str).str.contains('High Disparity'), 'color: red', 'color: black')
+
+# Chart spec is rebuilt only when the fairness data changes
+@st.cache_data
+def make_fairness_chart(chart_data):
+    return alt.Chart(chart_data).mark_bar().encode(
+        x='REGION',
+        y='AVG_AMOUNT',
+        color=alt.condition(
+            alt.datum.PERCENT_DIFF < -10,
+            alt.value("red"),  # The positive color
+            alt.value("green") # The negative color
+        ),
+        tooltip=['REGION', 'AVG_AMOUNT', 'PERCENT_DIFF', 'STATUS']
+    ).properties(height=400)
+
 # Header
 col1, col2 = st.columns([1, 4])
 with col1:
@@ -35,27 +150,31 @@ with st.sidebar:
     st.divider()
     
     st.subheader("Global Filter")
+    selected_region = "All"
+    report_requested = False
     # Fetch regions
     if data_source == "core.demo_beneficiaries":
         try:
-            regions_df = session.sql("SELECT DISTINCT region FROM core.demo_beneficiaries").to_pandas()
-            selected_region = st.selectbox("Select Region for Deep Dive", ["All"] + regions_df['REGION'].tolist())
+            regions = load_regions(data_source)
+            # Inside a form, picking a region doesn't rerun the dashboard until a button is pressed
+            with st.form("ai_form"):
+                selected_region = st.selectbox("Select Region for Deep Dive", ["All"] + regions)
+                st.form_submit_button("Apply Filter")
+                report_requested = st.form_submit_button("Generate Cortex Report")
+            if report_requested and selected_region == "All":
+                st.warning("Pick a specific region to generate a report.")
         except Exception as e:
             st.error(f"Setup incomplete. Run Setup Script. {e}")
-            selected_region = "All"
     else:
         st.info("Custom data source logic would go here.")
 
 # Main Logic
 try:
     # 1. Fetch High Level Metrics
-    df_coverage = session.table("core.vw_coverage_stats").to_pandas()
-    df_fairness = session.table("core.vw_fairness_analysis").to_pandas()
-    df_anomalies = session.table("core.vw_anomalies").to_pandas()
-    
-    total_aid = df_coverage['TOTAL_DISTRIBUTED'].sum()
-    total_ben = df_coverage['TOTAL_BENEFICIARIES'].sum()
-    avg_aid = df_coverage['AVG_AMOUNT'].mean() # Average of averages effectively/roughly
+    total_aid, total_ben, avg_aid = load_kpis()
+    df_fairness = load_fairness(selected_region)
+    anomalies_count = load_anomaly_count()
+    anomaly_cards = load_anomaly_cards(selected_region)
     
     # 2. KPI Section
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
@@ -64,7 +183,6 @@ try:
     kpi3.metric("Avg Aid / Person", f"${avg_aid:,.2f}")
     
     # Calculate System Health
-    anomalies_count = len(df_anomalies)
     kpi4.metric("Anomalies Detected", f"{anomalies_count}", delta=f"-{anomalies_count}" if anomalies_count > 0 else "0", delta_color="inverse")
     
     st.divider()
@@ -79,28 +197,19 @@ try:
         chart_data = df_fairness[['REGION', 'AVG_AMOUNT', 'PERCENT_DIFF', 'STATUS', 'DISTRIBUTION_TYPE']]
         
         # Bar Chart
-        c = alt.Chart(chart_data).mark_bar().encode(
-            x='REGION',
-            y='AVG_AMOUNT',
-            color=alt.condition(
-                alt.datum.PERCENT_DIFF < -10,
-                alt.value("red"),  # The positive color
-                alt.value("green") # The negative color
-            ),
-            tooltip=['REGION', 'AVG_AMOUNT', 'PERCENT_DIFF', 'STATUS']
-        ).properties(height=400)
+        c = make_fairness_chart(chart_data)
         
         st.altair_chart(c, use_container_width=True)
         
         st.subheader("Fairness Detail Grid")
-        st.dataframe(chart_data.style.applymap(lambda x: 'color: red' if 'High Disparity' in str(x) else 'color: black'), use_container_width=True)
+        st.dataframe(chart_data.style.apply(color_status, subset=['STATUS']), use_container_width=True)
 
     with tab2:
         st.subheader("AI-Driven Policy Insights")
         st.info("Select a region in the Sidebar to generate a specific report.")
         
         if selected_region and selected_region != "All":
-            if st.button(f"Generate Cortex Report for {selected_region}"):
+            if report_requested:
                 with st.spinner("Consulting AI Guardian..."):
                     try:
                         sql = f"CALL core.get_ai_summary('{selected_region}')"
@@ -111,7 +220,7 @@ try:
                         
                         # Add some fake "Actionable Steps" logic based on simple rules
                         st.markdown("#### Suggested Actions:")
-                        row = df_fairness[df_fairness['REGION'] == selected_region].iloc[0]
+                        row = df_fairness.iloc[0] # load_fairness already filtered to selected_region
                         if row['PERCENT_DIFF'] < -10:
                             st.write("- 🔍 **Audit Enrollment**: Enrollment rates are low. Deploy mobile registration teams.")
                             st.write("- 💰 **Review Allocation**: Immediate supplementary budget recommended.")
@@ -130,23 +239,14 @@ try:
         
         with col_risks:
             st.subheader("Active Risks")
-            if not df_anomalies.empty:
-                for index, row in df_anomalies.iterrows():
-                    risk_class = "risk-high" if row['RISK_SCORE'] == "High" else "risk-med"
-                    st.markdown(f"""
-                    <div class="{risk_class}">
-                        <b>{row['RISK_SCORE']} RISK</b><br>
-                        Beneficiary ID: {row['BENEFICIARY_ID']}<br>
-                        Issue: {row['ANOMALY_TYPE']}
-                    </div>
-                    <br>
-                    """, unsafe_allow_html=True)
+            if anomaly_cards:
+                st.markdown(anomaly_cards, unsafe_allow_html=True)
             else:
                 st.success("No active risks detected.")
                 
         with col_data:
             st.subheader("Raw Data Preview")
-            raw_data = session.table("core.demo_beneficiaries").limit(100).to_pandas()
+            raw_data = load_raw_preview("core.demo_beneficiaries")
             st.dataframe(raw_data, use_container_width=True)
 
 except Exception as e:
@@ -2,10 +2,18 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import glob
+import os
+import tempfile
 import time
 
 # --- MOCKING SNOWFLAKE SESSION ---
 # Since we are running locally without a connection, we simulate the data.
+# The AI report also waits FAIRAID_FAKE_LATENCY seconds (default 1.5) to mimic a Cortex call;
+# set it to 0 for smoke tests and benchmarking.
+FAKE_LATENCY = float(os.getenv('FAIRAID_FAKE_LATENCY', '1.5'))
 
 st.set_page_config(layout="wide", page_title="FairAid Guardian [LOCAL DEMO]")
 
@@ -19,6 +27,24 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+def color_status(status):
+    # Styler rule for the STATUS column only, evaluated for the whole column at once
+    return np.where(status.astype(str).str.contains('High Disparity'), 'color: red', 'color: black')
+
+# Chart spec is rebuilt only when the fairness data changes
+@st.cache_data
+def make_fairness_chart(chart_data):
+    return alt.Chart(chart_data).mark_bar().encode(
+        x='REGION',
+        y='AVG_AMOUNT',
+        color=alt.condition(
+            alt.datum.PERCENT_DIFF < -10,
+            alt.value("red"),
+            alt.value("green")
+        ),
+        tooltip=['REGION', 'AVG_AMOUNT', 'PERCENT_DIFF', 'STATUS']
+    ).properties(height=400)
+
 # Header
 col1, col2 = st.columns([1, 4])
 with col1:
@@ -27,63 +53,111 @@ with col1:
 with col2:
     st.title("FairAid Guardian (Local Demo Mode)")
     st.markdown("**AI-Powered Fairness & Leakage Monitor for Public Aid Programs**")
-    st.caption("ℹ️ Running in Local Mock Mode. Data is synthetic and generated in-memory.")
+    st.caption("ℹ️ Running in Local Mock Mode. Data is synthetic and generated locally.")
 
 # --- MOCK DATA GENERATION ---
+# The generated frame is also persisted as Feather so a fresh process can skip regeneration.
+# Bump the version suffix whenever the generation logic below changes. The file is keyed on
+# today's date so DATE_RECEIVED stays relative to the current day instead of the first run.
+MOCK_DATA_PATH = os.path.join(tempfile.gettempdir(), f"fairaid_mock_v4_{pd.Timestamp('today'):%Y%m%d}.arrow")
+
 @st.cache_data
-def load_mock_data():
+def load_mock_data(cache_path):
+    if os.path.exists(cache_path):
+        try:
+            return pd.read_feather(cache_path)
+        except Exception:
+            pass # Unreadable cache file: regenerate and overwrite it below
+
     # Simulate the SQL logic from setup_script.sql
-    np.random.seed(42)
-    regions = ['North', 'South', 'East', 'West']
-    bias = {'North': 1.2, 'South': 0.8, 'East': 1.0, 'West': 0.9}
-    
-    data = []
-    for _ in range(1000):
-        r = np.random.choice(regions)
-        base_income = np.random.uniform(100, 5000)
-        # Aid amount logic
-        amount = base_income * 0.1 * bias[r] + np.random.uniform(-50, 50)
-        amount = max(amount, 0)
-        
-        data.append({
-            'BENEFICIARY_ID': f"BEN-{np.random.randint(10000,99999)}",
-            'REGION': r,
-            'AGE_GROUP': np.random.choice(['18-29', '30-49', '50-69', '70+']),
-            'GENDER': np.random.choice(['M', 'F', 'NB']),
-            'AMOUNT_RECEIVED': round(amount, 2),
-            'DATE_RECEIVED': pd.Timestamp('now') - pd.Timedelta(days=np.random.randint(0,365))
-        })
-    
-    df = pd.DataFrame(data)
+    n = 1000
+    rng = np.random.default_rng(42)
+    regions = np.array(['North', 'South', 'East', 'West'])
+    bias = np.array([1.2, 0.8, 1.0, 0.9]) # Same order as regions
+    age_groups = np.array(['18-29', '30-49', '50-69', '70+'])
+    genders = np.array(['M', 'F', 'NB'])
+
+    region_idx = rng.integers(0, len(regions), size=n)
+    base_income = rng.uniform(100, 5000, size=n)
+    # Aid amount logic
+    amount = base_income * 0.1 * bias[region_idx] + rng.uniform(-50, 50, size=n)
+    amount = np.maximum(amount, 0)
+
+    ids = rng.integers(10000, 99999, size=n)
+    days = rng.integers(0, 365, size=n)
+    now = pd.Timestamp('now')
+
+    # Low-cardinality labels are built as categoricals straight from the sampled codes,
+    # so no strings are materialized or hashed per row
+    df = pd.DataFrame({
+        'BENEFICIARY_ID': np.char.add('BEN-', ids.astype(str)),
+        'REGION': pd.Categorical.from_codes(region_idx, regions),
+        'AGE_GROUP': pd.Categorical.from_codes(rng.integers(0, len(age_groups), size=n), age_groups),
+        'GENDER': pd.Categorical.from_codes(rng.integers(0, len(genders), size=n), genders),
+        'AMOUNT_RECEIVED': np.round(amount, 2),
+        'DATE_RECEIVED': now - pd.to_timedelta(days, unit='D')
+    })
     
     # Create Anomalies (Duplicates)
-    dupes = df.sample(5).copy()
-    dupes['AMOUNT_RECEIVED'] = dupes['AMOUNT_RECEIVED'] * 1.5 # Suspicious change
-    df = pd.concat([df, dupes])
-    
+    dup_idx = df.sample(5, random_state=rng).index
+    dupes = df.loc[dup_idx].assign(AMOUNT_RECEIVED=lambda d: d['AMOUNT_RECEIVED'] * 1.5) # Suspicious change
+    df = pd.concat([df, dupes], ignore_index=True) # Default index, which Feather requires
+
+    # Write to a temp file in the same directory and swap it in, so a killed or concurrent
+    # writer can never leave a truncated cache behind
+    cache_dir = os.path.dirname(cache_path)
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix="fairaid_mock_", suffix=".tmp")
+        os.close(fd)
+        df.to_feather(tmp_path)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass # The disk cache is only an optimization; keep the in-memory frame
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # Drop files from earlier days, older versions and interrupted writes
+    for old_path in glob.glob(os.path.join(cache_dir, "fairaid_mock_*")):
+        if old_path != cache_path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
     return df
 
-df_beneficiaries = load_mock_data()
+df_beneficiaries = load_mock_data(MOCK_DATA_PATH)
 
 # Calculate Logic (Simulating SQL Views)
 # 1. Coverage
-df_coverage = df_beneficiaries.groupby('REGION').agg(
+df_coverage = df_beneficiaries.groupby('REGION', observed=True).agg(
     TOTAL_BENEFICIARIES=('BENEFICIARY_ID', 'nunique'),
     TOTAL_DISTRIBUTED=('AMOUNT_RECEIVED', 'sum'),
-    AVG_AMOUNT=('AMOUNT_RECEIVED', 'mean')
+    AVG_AMOUNT=('AMOUNT_RECEIVED', 'mean'),
+    RECORD_COUNT=('AMOUNT_RECEIVED', 'size')
 ).reset_index()
 
 # 2. Fairness
-global_avg = df_beneficiaries['AMOUNT_RECEIVED'].mean()
-df_fairness = df_coverage.copy()
+# Global mean from the per-region totals (4 rows) rather than another scan over every record.
+# Divide by records, not TOTAL_BENEFICIARIES, which counts unique IDs only.
+global_avg = df_coverage['TOTAL_DISTRIBUTED'].sum() / df_coverage['RECORD_COUNT'].sum()
+df_fairness = df_coverage.drop(columns='RECORD_COUNT')
 df_fairness['GLOBAL_AVG'] = global_avg
 df_fairness['PERCENT_DIFF'] = ((df_fairness['AVG_AMOUNT'] - global_avg) / global_avg) * 100
-df_fairness['STATUS'] = df_fairness['PERCENT_DIFF'].apply(lambda x: 'High Disparity' if abs(x) > 20 else ('Moderate Disparity' if abs(x) > 10 else 'Fair'))
-df_fairness['DISTRIBUTION_TYPE'] = df_fairness['PERCENT_DIFF'].apply(lambda x: 'Underfunded' if x < -15 else ('Overfunded' if x > 15 else 'Balanced'))
+pct_diff = df_fairness['PERCENT_DIFF'].to_numpy()
+df_fairness['STATUS'] = np.select([np.abs(pct_diff) > 20, np.abs(pct_diff) > 10], ['High Disparity', 'Moderate Disparity'], default='Fair')
+df_fairness['DISTRIBUTION_TYPE'] = np.select([pct_diff < -15, pct_diff > 15], ['Underfunded', 'Overfunded'], default='Balanced')
+df_fairness_idx = df_fairness.set_index('REGION') # Hash lookup for the per-region report
 
 # 3. Anomalies
-dup_counts = df_beneficiaries.groupby('BENEFICIARY_ID').size()
-dupes = dup_counts[dup_counts > 1].reset_index(name='record_count')
+# Count IDs with Arrow's C++ hash kernel rather than a pandas hash-agg over Python strings
+id_counts = pc.value_counts(pa.array(df_beneficiaries['BENEFICIARY_ID'], type=pa.string()))
+dup_mask = pc.greater(id_counts.field('counts'), 1)
+dupes = pd.DataFrame({
+    'BENEFICIARY_ID': id_counts.field('values').filter(dup_mask).to_pandas(),
+    'record_count': id_counts.field('counts').filter(dup_mask).to_pandas()
+})
 dupes['ANOMALY_TYPE'] = 'Duplicate Record'
 dupes['RISK_SCORE'] = 'High'
 df_anomalies = dupes.copy() # Simplification for demo
@@ -96,7 +170,12 @@ with st.sidebar:
     st.divider()
     
     st.subheader("Global Filter")
-    selected_region = st.selectbox("Select Region for Deep Dive", ["All"] + df_coverage['REGION'].tolist())
+    # Inside a form, picking a region doesn't rerun the dashboard until a button is pressed
+    with st.form("ai_form"):
+        selected_region = st.selectbox("Select Region for Deep Dive", ["All"] + df_coverage['REGION'].tolist())
+        report_requested = st.form_submit_button("Generate Cortex Report")
+    if report_requested and selected_region == "All":
+        st.warning("Pick a specific region to generate a report.")
 
 # --- MAIN DASHBOARD ---
 
@@ -121,32 +200,24 @@ with tab1:
     st.markdown("Comparing regional distribution against the global average.")
     
     # Bar Chart
-    c = alt.Chart(df_fairness).mark_bar().encode(
-        x='REGION',
-        y='AVG_AMOUNT',
-        color=alt.condition(
-            alt.datum.PERCENT_DIFF < -10,
-            alt.value("red"),
-            alt.value("green")
-        ),
-        tooltip=['REGION', 'AVG_AMOUNT', 'PERCENT_DIFF', 'STATUS']
-    ).properties(height=400)
+    c = make_fairness_chart(df_fairness)
     
     st.altair_chart(c, use_container_width=True)
     
-    st.dataframe(df_fairness.style.map(lambda x: 'color: red' if 'High Disparity' in str(x) else 'color: black'), use_container_width=True)
+    st.dataframe(df_fairness.style.apply(color_status, subset=['STATUS']), use_container_width=True)
 
 with tab2:
     st.subheader("AI-Driven Policy Insights")
     st.info("Select a region in the Sidebar to generate a specific report.")
     
     if selected_region and selected_region != "All":
-        if st.button(f"Generate Cortex Report for {selected_region}"):
+        if report_requested:
             with st.spinner("Consulting AI Guardian (Simulated)..."):
-                time.sleep(1.5) # Fake latency
+                if FAKE_LATENCY:
+                    time.sleep(FAKE_LATENCY)
                 
                 # Mock AI Retrieval Logic
-                row = df_fairness[df_fairness['REGION'] == selected_region].iloc[0]
+                row = df_fairness_idx.loc[selected_region]
                 diff = row['PERCENT_DIFF']
                 
                 if diff < -15:
@@ -175,8 +246,8 @@ with tab3:
     with col_risks:
         st.subheader("Active Risks")
         if not df_anomalies.empty:
-            for index, row in df_anomalies.iterrows():
-                st.error(f"High Risk: {row['BENEFICIARY_ID']} - Duplicate Record")
+            risk_lines = "High Risk: " + df_anomalies['BENEFICIARY_ID'].astype(str) + " - Duplicate Record"
+            st.error(risk_lines.str.cat(sep="  \n"))
         else:
             st.success("No active risks detected.")
             